@@ -0,0 +1,75 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import IO
+
+logger = logging.getLogger("kql")
+
+
+@dataclass
+class ResultCache:
+    """
+    On-disk cache of raw az query results.
+
+    Attributes:
+        directory: Folder holding the cached results, one file per key
+        ttl_seconds: Number of seconds a cached result stays valid
+    """
+
+    directory: str
+    ttl_seconds: float
+
+    def __post_init__(self) -> None:
+        # Verify the TTL can ever produce a cache hit
+        if self.ttl_seconds <= 0:
+            raise ValueError(
+                f"Cache TTL must be a positive number of seconds: {self.ttl_seconds}"
+            )
+
+    @staticmethod
+    def make_key(*parts: str | bytes) -> str:
+        """Build a cache key from everything that determines a query result."""
+        digest = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            data = part.encode() if isinstance(part, str) else part
+            # Prefix each part with its length so ("ab", "c") != ("a", "bc")
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> IO[bytes] | None:
+        """Open the cached result for a key, or return None if missing or stale."""
+        path = self._path(key)
+        try:
+            if time.time() - os.stat(path).st_mtime >= self.ttl_seconds:
+                logger.debug("Cached result expired: %s", path)
+                return None
+            return open(path, "rb")
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            # The cache is only a speed-up, so an unusable entry is a miss
+            logger.warning("Could not read cached result %s: %s", path, e)
+            return None
+
+    def put(self, key: str, result_file: IO[bytes]) -> None:
+        """Store a result, replacing any previous entry for the key atomically."""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_file = tempfile.NamedTemporaryFile(
+            dir=self.directory, suffix=".tmp", delete=False
+        )
+        try:
+            with tmp_file:
+                shutil.copyfileobj(result_file, tmp_file)
+            os.replace(tmp_file.name, self._path(key))
+        except BaseException:
+            # Do not leave a partial entry behind in the cache directory
+            os.unlink(tmp_file.name)
+            raise
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.out")
@@ -1,12 +1,12 @@
+import functools
 import json
 import logging
 import os
+import stat
 import sys
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
-import jsonschema
-import yaml
 from model import (
     CompressionType,
     KQLConfig,
@@ -15,34 +15,117 @@ from model import (
     QueryConfig,
 )
 
+logger = logging.getLogger("kql")
+
+# yaml and jsonschema are imported where they are used: jsonschema alone takes
+# tens of milliseconds to import, which --help and argument errors never need
+if TYPE_CHECKING:
+    import jsonschema
+
+# This file lives in .github/scripts/kql_query_executor, three levels below the root
+_REPO_ROOT = Path(__file__).resolve().parents[3]
+_CONFIG_FILE_NAMES = (".kql-config.yaml", ".kql-config.yml")
+_SCHEMA_PATH = _REPO_ROOT / "kql-config-schema.json"
+
+
+@functools.lru_cache(maxsize=4)
+def _get_validator(schema_path: str, mtime_ns: int) -> "jsonschema.protocols.Validator":
+    """
+    Load a JSON schema once and return a reusable validator for it.
+
+    The modification time is part of the cache key, so an edited schema is
+    loaded again.
+    """
+    import jsonschema
+
+    with open(schema_path, "r") as schema_file:
+        schema = json.load(schema_file)
+
+    # Check the schema against its meta-schema once, not on every validation
+    validator_cls = jsonschema.validators.validator_for(
+        schema, default=jsonschema.Draft7Validator
+    )
+    validator_cls.check_schema(schema)
+    return validator_cls(schema)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_yaml(config_path: str, mtime_ns: int) -> dict[str, Any]:
+    """
+    Parse a YAML config file once per modification time.
+
+    The returned dictionary is shared between callers and must not be modified.
+    """
+    import yaml
+
+    # Prefer the libyaml-backed loader, which parses several times faster
+    yaml_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(config_path, "r") as file:
+        return yaml.load(file, Loader=yaml_loader) or {}
+
+
+def _validate_config(
+    config_dict: dict[str, Any], config_path: str, schema_path: str
+) -> str | None:
+    """Validate a config against a schema, returning an error message if invalid."""
+    import jsonschema
+
+    try:
+        validator = _get_validator(schema_path, os.stat(schema_path).st_mtime_ns)
+        # Valid configs only need a yes/no answer; build an error report
+        # only when there is something to report
+        if validator.is_valid(config_dict):
+            return None
+        validator.validate(config_dict)
+    except json.JSONDecodeError as e:
+        return f"Invalid JSON schema file {schema_path}: {e}"
+    except jsonschema.exceptions.ValidationError as e:
+        # Provide more detailed validation error message
+        return f"Config validation failed for {config_path}: {e.message}\n"
+    return None
+
+
+def find_config_file(folder_path: str, repo_root: Path | None = None) -> str | None:
+    """
+    Find the config file in the folder or repository root.
+
+    The repository root defaults to the one containing this script.
+    """
+    if repo_root is None:
+        repo_root = _REPO_ROOT
 
-def find_config_file(folder_path: str) -> str | None:
-    """Find the config file in the folder or repository root."""
     # First check in the specified folder
-    for ext in ["yaml", "yml"]:
-        config_file = os.path.join(folder_path, f".kql-config.{ext}")
-        if os.path.exists(config_file):
+    for name in _CONFIG_FILE_NAMES:
+        config_file = os.path.join(folder_path, name)
+        if os.path.isfile(config_file):
             return config_file
 
     # If not found in folder, check repository root
-    repo_root = Path(__file__).parent.parent.parent.parent
-    for ext in ["yaml", "yml"]:
-        root_config_file = repo_root / f".kql-config.{ext}"
-        if root_config_file.exists():
-            logging.debug(f"Found config file in repository root: {root_config_file}")
+    for name in _CONFIG_FILE_NAMES:
+        root_config_file = repo_root / name
+        if root_config_file.is_file():
+            logger.debug("Found config file in repository root: %s", root_config_file)
             return str(root_config_file)
 
     return None
 
 
 def validate_file_path(file_path: str, config_dir: str) -> str:
-    """Validate that a query file exists and ends with .kql."""
+    """
+    Validate that a query file exists and ends with .kql.
+
+    Whitespace in paths is rejected by the QueryConfig and OutputConfig models.
+    """
     if not file_path.endswith(".kql"):
         raise ValueError(f"Query file must end with .kql: {file_path}")
 
     # Handle relative paths from config file location
     abs_path = os.path.normpath(os.path.join(config_dir, file_path))
-    if not os.path.isfile(abs_path):
+    try:
+        is_file = stat.S_ISREG(os.stat(abs_path).st_mode)
+    except OSError:
+        is_file = False
+    if not is_file:
         raise ValueError(
             f"Query file does not exist: {file_path} (resolved to {abs_path})"
         )
@@ -55,6 +138,9 @@ def convert_dict_to_config(config_dict: dict[str, Any], config_dir: str) -> KQLC
     try:
         # Process queries section
         queries = []
+        # Output files already checked on disk, since several outputs often
+        # share a file and each should only be resolved and reported once
+        checked_outputs: set[str] = set()
         if "queries" in config_dict:
             for query_dict in config_dict["queries"]:
                 validate_file_path(query_dict["file"], config_dir)
@@ -70,32 +156,6 @@ def convert_dict_to_config(config_dict: dict[str, Any], config_dir: str) -> KQLC
                         except ValueError:
                             raise ValueError(f"Invalid output format: {format_str}")
 
-                        # Handle output file based on format
-                        output_file = fmt.get("file")
-                        if output_file and output_format != OutputFormat.NONE:
-                            # Verify file path doesn't contain whitespace
-                            if any(c.isspace() for c in output_file):
-                                raise ValueError(
-                                    f"Output file path should not contain whitespace: '{output_file}'. "
-                                    f"Use underscores or dashes instead."
-                                )
-
-                            # Check if file exists (will be overwritten)
-                            abs_file_path = os.path.normpath(
-                                os.path.join(config_dir, output_file)
-                            )
-                            if os.path.exists(abs_file_path):
-                                logging.warning(
-                                    f"Output file exists and will be overwritten: {output_file}"
-                                )
-
-                            # Ensure directory exists
-                            dir_path = os.path.dirname(abs_file_path)
-                            if not os.path.exists(dir_path):
-                                logging.info(
-                                    f"Directory does not exist and will be created: {dir_path}"
-                                )
-
                         # Handle compression
                         compression_str = fmt.get("compression")
                         compression = None
@@ -107,13 +167,45 @@ def convert_dict_to_config(config_dict: dict[str, Any], config_dir: str) -> KQLC
                                     f"Invalid compression type: {compression_str}"
                                 )
 
-                        # Create output config
+                        # Create output config; it rejects file paths with whitespace
+                        output_file = fmt.get("file")
                         format_config = OutputConfig(
                             format=output_format,
                             query=fmt.get("query"),  # JMESPath query
                             file=output_file,  # Full file path if specified
                             compression=compression,
                         )
+
+                        # Report what writing the output file will do
+                        if (
+                            output_file
+                            and output_format != OutputFormat.NONE
+                            and output_file not in checked_outputs
+                        ):
+                            checked_outputs.add(output_file)
+                            # Check if file exists (will be overwritten). Its
+                            # directory only needs checking when it does not.
+                            abs_file_path = os.path.normpath(
+                                os.path.join(config_dir, output_file)
+                            )
+                            try:
+                                os.stat(abs_file_path)
+                                logger.warning(
+                                    "Output file exists and will be overwritten: %s",
+                                    output_file,
+                                )
+                            except FileNotFoundError:
+                                dir_path = os.path.dirname(abs_file_path)
+                                if not os.path.exists(dir_path):
+                                    logger.info(
+                                        "Directory does not exist and will be created: %s",
+                                        dir_path,
+                                    )
+                            except OSError:
+                                # Informational only; writing the output
+                                # reports any real problem with the path
+                                pass
+
                         query_output.append(format_config)
 
                 query_config = QueryConfig(
@@ -127,90 +219,113 @@ def convert_dict_to_config(config_dict: dict[str, Any], config_dir: str) -> KQLC
             queries=queries,
         )
     except Exception as e:
-        logging.error(f"Error converting configuration: {e}")
+        logger.error("Error converting configuration: %s", e)
         sys.exit(1)
 
 
-def load_config(config_path: str, schema_path: str | None = None) -> KQLConfig:
-    """Load and validate the configuration file against schema."""
+def load_config(
+    config_path: str, schema_path: str | None = None, skip_validation: bool = False
+) -> KQLConfig:
+    """
+    Load and validate the configuration file against schema.
+
+    Parsed configs and compiled schemas are cached per file modification time,
+    so repeated loads of unchanged files skip parsing and schema compilation.
+    """
+    import yaml
+
+    # Handle schema validation
+    if not schema_path:
+        schema_path = str(_SCHEMA_PATH)
+
+    # Every failure below is logged and ends in a single exit
     try:
-        # Try to load YAML config
-        try:
-            with open(config_path, "r") as file:
-                config_dict = yaml.safe_load(file) or {}
-        except yaml.YAMLError as e:
-            logging.error(f"Invalid YAML format in {config_path}: {str(e)}")
-            sys.exit(1)
-        except FileNotFoundError:
-            logging.error(f"Configuration file not found: {config_path}")
-            sys.exit(1)
-
-        # Handle schema validation
-        if not schema_path:
-            repo_root = Path(__file__).parent.parent.parent.parent
-            schema_path = str(repo_root / "kql-config-schema.json")
-
-        if not os.path.exists(schema_path):
-            logging.warning(
-                f"Schema file not found at {schema_path}, skipping validation"
+        config_dict = _load_yaml(config_path, os.stat(config_path).st_mtime_ns)
+
+        error = None
+        if skip_validation:
+            logger.info("Schema validation disabled, skipping validation")
+        elif not os.path.isfile(schema_path):
+            logger.warning(
+                "Schema file not found at %s, skipping validation", schema_path
             )
         else:
-            try:
-                with open(schema_path, "r") as schema_file:
-                    schema = json.load(schema_file)
-                jsonschema.validate(instance=config_dict, schema=schema)
-            except json.JSONDecodeError as e:
-                logging.error(f"Invalid JSON schema file {schema_path}: {str(e)}")
-                sys.exit(1)
-            except jsonschema.exceptions.ValidationError as e:
-                # Provide more detailed validation error message
-                logging.error(
-                    f"Config validation failed for {config_path}: {e.message}\n"
-                )
-                sys.exit(1)
+            error = _validate_config(config_dict, config_path, schema_path)
 
-        # Convert config dictionary to object
-        config_dir = os.path.dirname(os.path.abspath(config_path))
-        try:
+        if error is None:
+            # Convert config dictionary to object
+            config_dir = os.path.dirname(os.path.abspath(config_path))
             return convert_dict_to_config(config_dict, config_dir)
-        except ValueError as e:
-            logging.error(f"Invalid configuration value: {str(e)}")
-            sys.exit(1)
-        except KeyError as e:
-            logging.error(f"Missing required configuration key: {str(e)}")
-            sys.exit(1)
-
+        logger.error("%s", error)
+
+    except yaml.YAMLError as e:
+        logger.error("Invalid YAML format in %s: %s", config_path, e)
+    except FileNotFoundError:
+        logger.error("Configuration file not found: %s", config_path)
+    except ValueError as e:
+        logger.error("Invalid configuration value: %s", e)
+    except KeyError as e:
+        logger.error("Missing required configuration key: %s", e)
     except Exception as e:
         # Catch-all for unexpected errors with more context
-        logging.error(
-            f"Unexpected error loading config {config_path}:\n"
-            f"  Type: {type(e).__name__}\n"
-            f"  Error: {str(e)}"
+        logger.error(
+            "Unexpected error loading config %s:\n  Type: %s\n  Error: %s",
+            config_path,
+            type(e).__name__,
+            e,
         )
-        sys.exit(1)
+    sys.exit(1)
+
+
+def find_kql_files(folder_path: str) -> list[str]:
+    """Recursively find all KQL files in a folder, relative to that folder."""
+    # os.scandir exposes the entry type from the directory listing itself, so
+    # unlike os.walk no stat call is needed for each entry
+    kql_files = []
+    pending_dirs = [folder_path]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        subdirs = []
+        try:
+            with os.scandir(current_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.endswith(".kql") and entry.is_file():
+                        # Get path relative to the specified folder
+                        kql_files.append(os.path.relpath(entry.path, folder_path))
+        except OSError as e:
+            logger.warning("Skipping unreadable directory %s: %s", current_dir, e)
+            continue
+
+        # Visit subdirectories in listing order, after the current directory
+        pending_dirs.extend(reversed(subdirs))
+
+    return kql_files
 
 
 def get_applicable_files(folder_path: str, config: KQLConfig) -> list[str]:
     """Get list of applicable KQL files based on config."""
     # If no queries are configured, find all KQL files in the folder and subfolders
     if not config.queries:
-        all_files = []
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                if file.endswith(".kql"):
-                    # Get path relative to the specified folder
-                    rel_path = os.path.relpath(os.path.join(root, file), folder_path)
-                    all_files.append(rel_path)
-        return all_files
+        return find_kql_files(folder_path)
 
     # If queries are configured, use only those files
     config_files = []
+    seen_files: set[str] = set()
 
     # The folder_path is used as the base for relative paths
     # We don't need to get parent directory which causes the "../" prefix issue
 
     for query in config.queries:
         file_path = query.file
+
+        # A file listed more than once would otherwise be executed more than once
+        if file_path in seen_files:
+            logger.debug("Skipping duplicate query file entry: %s", file_path)
+            continue
+        seen_files.add(file_path)
+
         try:
             # Check if the file exists in the folder or a subdirectory
             # First try as relative to folder_path
@@ -221,42 +336,58 @@ def get_applicable_files(folder_path: str, config: KQLConfig) -> list[str]:
                 config_files.append(file_path)
             else:
                 # File doesn't exist, log warning and skip
-                logging.warning(f"Query file does not exist: {file_path}")
+                logger.warning("Query file does not exist: %s", file_path)
                 # Don't add to config_files
         except Exception as e:
-            logging.warning(f"Skipping invalid query file {file_path}: {e}")
+            logger.warning("Skipping invalid query file %s: %s", file_path, e)
             continue
 
     if not config_files:
-        logging.warning("No valid query files found in configuration")
+        logger.warning("No valid query files found in configuration")
 
     return config_files
 
 
-def get_output_configs_for_query(config: KQLConfig, file: str) -> list[OutputConfig]:
-    """Determine which output configs to use for a query."""
-    # Get the base name without extension
-    file_path_variations = [
-        file,  # Just the file name
-        os.path.join("*", file),  # Any subfolder/file name
-        f"**/{file}",  # Any nested path to file name
-    ]
-
-    # Check if there's a specific query configuration
-    if config.queries:
-        for query in config.queries:
-            # Check if this config applies to our file
-            # Match by either exact path or filename
-            query_file = query.file
-            file_basename = os.path.basename(query_file)
-
-            if file == file_basename or any(
-                file_pattern in query_file for file_pattern in file_path_variations
-            ):
-                if query.output:
-                    logging.debug(f"Found specific output config for {file}")
-                    return query.output
+def build_query_index(config: KQLConfig) -> dict[str, list[OutputConfig]]:
+    """
+    Map every way a query file can be referred to onto its output configs.
+
+    A configured file "a/b/q.kql" is reachable as "a/b/q.kql", "b/q.kql" and
+    "q.kql". When several queries share a key, the first one listed wins.
+    """
+    index: dict[str, list[OutputConfig]] = {}
+    for query in config.queries:
+        # Queries without outputs fall through to later entries or the default
+        if not query.output:
+            continue
+
+        parts = query.file.split("/")
+        for i in range(len(parts)):
+            index.setdefault("/".join(parts[i:]), query.output)
+    return index
+
+
+def get_output_configs_for_query(
+    config: KQLConfig,
+    file: str,
+    query_index: dict[str, list[OutputConfig]] | None = None,
+) -> list[OutputConfig]:
+    """
+    Determine which output configs to use for a query.
+
+    Pass the result of build_query_index to avoid rebuilding it on every call.
+    """
+    if query_index is None:
+        query_index = build_query_index(config)
+
+    # Check if there's a specific query configuration. Only configured paths
+    # ending in the whole relative path match, so "other/q.kql" does not pick
+    # up the outputs configured for "q.kql" or "x/q.kql".
+    output = query_index.get(file)
+    if output:
+        logger.debug("Found specific output config for %s", file)
+        return output
 
     # If no specific configuration found, use default JSON output to console
-    logging.debug(f"Using default JSON output for {file}")
+    logger.debug("Using default JSON output for %s", file)
     return [OutputConfig(format=OutputFormat.JSON)]
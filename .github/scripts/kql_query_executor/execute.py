@@ -1,119 +1,291 @@
-import gzip
+import contextlib
 import logging
 import os
+import re
 import shutil
 import subprocess
+import sys
+import tempfile
+import threading
+from collections.abc import Iterator
 from pathlib import Path
+from typing import IO
 
+from cache import ResultCache
 from config import get_output_configs_for_query
-from model import CompressionType, KQLConfig, OutputFormat
+from model import CompressionType, KQLConfig, OutputConfig, OutputFormat
 
+logger = logging.getLogger("kql")
 
-def execute_query(
-    folder_path: str, query_file: str, workspace_id: str, config: KQLConfig
-) -> bool:  # noqa: C901
-    """Execute a KQL query and process the results."""
-    # Convert folder_path to Path object
-    base_path = Path(folder_path)
-    query_path = base_path / query_file
+# Deflate level for gzip and zip outputs. Level 6 keeps nearly all of the
+# ratio of level 9 (the gzip default) at a fraction of the CPU time.
+DEFAULT_COMPRESS_LEVEL = 6
 
-    # Verify query file exists
-    if not query_path.exists():
-        logging.error(f"Query file not found: {query_path}")
-        return False
+# Chunk size for copying results into output files. Each chunk is one
+# deflate call and one write for compressed outputs, so larger chunks cut
+# per-call overhead on big results.
+_COPY_BUFSIZE = 128 * 1024
 
-    logging.info(f"Executing {query_path}...")
+# Any run of whitespace in a JMESPath query collapses to a single space
+_WS_RE = re.compile(r"\s+")
 
-    # Get output configurations for this query
-    output_configs = get_output_configs_for_query(config, query_file)
-    if not output_configs:
-        logging.error(f"No output configuration found for query: {query_path}")
-        return False
+# Environment defaults for az invocations. Telemetry upload spawns an extra
+# process at the end of every az command; users can still opt back in.
+_AZ_ENV_DEFAULTS = {"AZURE_CORE_COLLECT_TELEMETRY": "false"}
+
+# Queries run concurrently, so console output must be printed as one block
+_console_lock = threading.Lock()
+
+# Output directories already created by this process
+_ensured_dirs: set[str] = set()
+
+
+def _ensure_dir(dir_path: str) -> None:
+    """Create an output directory once per process."""
+    if dir_path and dir_path not in _ensured_dirs:
+        os.makedirs(dir_path, exist_ok=True)
+        _ensured_dirs.add(dir_path)
+
+
+# Several queries may write the same output file, so concurrent writers of a
+# path take turns. Locks are created on first use under _output_locks_guard.
+_output_locks: dict[str, threading.Lock] = {}
+_output_locks_guard = threading.Lock()
+
+
+def _output_lock(path: str) -> threading.Lock:
+    """Return the write lock of an output path."""
+    with _output_locks_guard:
+        return _output_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+@contextlib.contextmanager
+def _open_sink(
+    target_file: str,
+    compression: CompressionType | None,
+    entry_name: str,
+    entry_size: int,
+    compress_level: int,
+) -> Iterator[IO[bytes]]:
+    """Open an output file for writing, compressing what is written to it."""
+    if compression == CompressionType.GZIP:
+        import gzip
+
+        with gzip.open(target_file, "wb", compresslevel=compress_level) as f:
+            yield f
+        logger.info("Compressed results with gzip: %s", target_file)
+    elif compression == CompressionType.ZIP:
+        import zipfile
+
+        # Entries over 2 GiB need ZIP64 headers, which must be chosen upfront
+        with (
+            zipfile.ZipFile(
+                target_file,
+                "w",
+                zipfile.ZIP_DEFLATED,
+                compresslevel=compress_level,
+            ) as archive,
+            archive.open(
+                entry_name,
+                "w",
+                force_zip64=entry_size > zipfile.ZIP64_LIMIT,
+            ) as f,
+        ):
+            yield f
+        logger.info("Compressed results with zip: %s", target_file)
+    else:
+        with open(target_file, "wb") as f:
+            yield f
+        logger.info("Results saved to %s", target_file)
+
+
+def _process_outputs(
+    output_configs: list[OutputConfig],
+    query_path: Path,
+    file_path: str,
+    workspace_id: str,
+    cache: ResultCache | None = None,
+    compress_level: int = DEFAULT_COMPRESS_LEVEL,
+) -> bool:  # noqa: C901
+    """Run the az invocations needed for a query and write every output."""
+    # The ExitStack closes the result buffers once all outputs are handled
+    with contextlib.ExitStack() as stack:
+        # Results of az invocations already run for this query, keyed by
+        # (format, JMESPath query). Outputs that only differ in destination or
+        # compression reuse the same result instead of querying Azure again.
+        # Each result is kept in an anonymous temporary file that az writes to
+        # directly, so large results never have to be held in memory.
+        results: dict[tuple[OutputFormat, str | None], IO[bytes]] = {}
+        az_env = {**_AZ_ENV_DEFAULTS, **os.environ}
+
+        # The part of the Azure CLI command shared by every output
+        base_cmd = [
+            "az",
+            "monitor",
+            "log-analytics",
+            "query",
+            "-w",
+            workspace_id,
+            "--analytics-query",
+            f"@{query_path}",
+        ]
+        # The query text is part of the cache key, so only read it when needed
+        query_text = query_path.read_bytes() if cache else b""
 
-    try:
         # Process each output format
         for fmt in output_configs:
             # Skip processing if format is NONE
             if fmt.format == OutputFormat.NONE:
-                logging.info(f"Skipping output for {query_path} (format: none)")
+                logger.info("Skipping output for %s (format: none)", query_path)
                 continue
 
-            # Build Azure CLI command with output format
-            cmd = [
-                "az",
-                "monitor",
-                "log-analytics",
-                "query",
-                "-w",
-                workspace_id,
-                "--analytics-query",
-                f"@{query_path}",
-                "--output",
-                fmt.format.value,  # Use format enum value directly
-            ]
-
-            # Add JMESPath query if specified
+            # Clean up the JMESPath query string, if specified, by collapsing
+            # newlines and runs of spaces into single spaces
+            clean_query = None
             if fmt.query:
-                # Clean up the query string:
-                # 1. Remove newlines and extra spaces
-                # 2. Escape any existing quotes
-                # 3. Wrap in quotes if needed
-                clean_query = fmt.query.strip().replace("\n", " ").replace("  ", " ")
-                cmd.extend(["--query", clean_query])
+                clean_query = _WS_RE.sub(" ", fmt.query).strip()
+
+            result_key = (fmt.format, clean_query)
+            if result_key in results:
+                logger.debug("Reusing %s result for %s", fmt.format.value, query_path)
+                result_file = results[result_key]
+            else:
+                cache_key, result_file = None, None
+                if cache:
+                    cache_key = cache.make_key(
+                        workspace_id, query_text, fmt.format.value, clean_query or ""
+                    )
+                    result_file = cache.get(cache_key)
+
+                if result_file is not None:
+                    stack.enter_context(result_file)
+                    logger.info(
+                        "Using cached %s result for %s", fmt.format.value, query_path
+                    )
+                else:
+                    # Build Azure CLI command with output format
+                    cmd = [
+                        *base_cmd,
+                        "--output",
+                        fmt.format.value,  # Use format enum value directly
+                    ]
+
+                    # Add JMESPath query if specified
+                    if clean_query:
+                        cmd.extend(["--query", clean_query])
 
-            # Execute the command
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)  # noqa: S603
-            filtered_result = result.stdout.strip()
+                    # Execute the command, streaming its output straight to disk
+                    result_file = stack.enter_context(tempfile.TemporaryFile())
+                    completed = subprocess.run(  # noqa: S603
+                        cmd,
+                        stdout=result_file,
+                        stderr=subprocess.PIPE,
+                        text=True,
+                        env=az_env,
+                        check=False,
+                    )
+                    if completed.returncode:
+                        logger.error(
+                            "Error executing query %s: az exited with code %s",
+                            query_path,
+                            completed.returncode,
+                        )
+                        if completed.stderr:
+                            logger.error("Error details: %s", completed.stderr)
+                        return False
+
+                    # A failure to fill the cache must not fail the query itself
+                    if cache:
+                        result_file.seek(0)
+                        try:
+                            cache.put(cache_key, result_file)
+                        except OSError as e:
+                            logger.warning(
+                                "Could not cache result for %s: %s", query_path, e
+                            )
+                results[result_key] = result_file
 
             # Process the results
+            result_file.seek(0)
             if not fmt.file:
                 # Display to console
-                print(f"Results for {query_file}")
-                print("-" * 80)
-                print(filtered_result)
-                print(end="\n\n")
-                logging.info(f"Results for {query_file} displayed to console")
+                filtered_result = result_file.read().decode().strip()
+                with _console_lock:
+                    sys.stdout.write(
+                        f"Results for {file_path}\n{'-' * 80}\n{filtered_result}\n\n\n"
+                    )
+                    sys.stdout.flush()
+                logger.info("Results for %s displayed to console", file_path)
                 continue
 
             # Process file output
             output_file = fmt.file
+            output_name = os.path.basename(output_file)
+            if fmt.compression == CompressionType.GZIP:
+                target_file = f"{output_file}.gz"
+            elif fmt.compression == CompressionType.ZIP:
+                target_file = f"{os.path.splitext(output_file)[0]}.zip"
+            else:
+                target_file = output_file
 
             # Ensure output directory exists
-            os.makedirs(os.path.dirname(output_file), exist_ok=True)
-
-            # Write the results to file
-            with open(output_file, "w") as f:
-                f.write(filtered_result)
-            logging.info(f"Results saved to {output_file}")
-
-            # Apply compression if specified
-            if fmt.compression:
-                if fmt.compression == CompressionType.GZIP:
-                    with (
-                        open(output_file, "rb") as f_in,
-                        gzip.open(f"{output_file}.gz", "wb") as f_out,
-                    ):
-                        shutil.copyfileobj(f_in, f_out)
-                    os.remove(output_file)
-                    logging.info(f"Compressed results with gzip: {output_file}.gz")
-                elif fmt.compression == CompressionType.ZIP:
-                    zip_base = os.path.splitext(output_file)[0]
-                    shutil.make_archive(
-                        zip_base,
-                        "zip",
-                        root_dir=os.path.dirname(output_file),
-                        base_dir=os.path.basename(output_file),
-                    )
-                    os.remove(output_file)
-                    logging.info(f"Compressed results with zip: {zip_base}.zip")
+            _ensure_dir(os.path.dirname(output_file))
+
+            # Stream the results to disk, compressing them on the way if requested
+            result_size = os.fstat(result_file.fileno()).st_size
+            with (
+                _output_lock(target_file),
+                _open_sink(
+                    target_file,
+                    fmt.compression,
+                    output_name,
+                    result_size,
+                    compress_level,
+                ) as f,
+            ):
+                shutil.copyfileobj(result_file, f, _COPY_BUFSIZE)
 
         return True
 
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error executing query {query_path}: {e}")
-        if hasattr(e, "stderr") and e.stderr:
-            logging.error(f"Error details: {e.stderr}")
-        return False
+
+def execute_query(
+    folder_path: str,
+    file_path: str,
+    workspace_id: str,
+    config: KQLConfig,
+    cache: ResultCache | None = None,
+    query_index: dict[str, list[OutputConfig]] | None = None,
+    compress_level: int = DEFAULT_COMPRESS_LEVEL,
+) -> bool:
+    """
+    Execute a KQL query and process the results.
+
+    When a cache is given, fresh cached results are used instead of querying
+    Azure, and new results are stored in it. Callers running many queries
+    should pass a query index from build_query_index, built once.
+
+    Safe to call from multiple threads. Queries that share an output file
+    write it one at a time, so the file holds the complete output of
+    whichever query wrote it last.
+    """
+    # Convert folder_path to Path object
+    base_path = Path(folder_path)
+    query_path = base_path / file_path
+
+    logger.info("Executing %s...", query_path)
+
+    # Get output configurations for this query
+    output_configs = get_output_configs_for_query(config, file_path, query_index)
+
+    try:
+        return _process_outputs(
+            output_configs,
+            query_path,
+            file_path,
+            workspace_id,
+            cache,
+            compress_level,
+        )
     except Exception as e:
-        logging.error(f"Unexpected error processing {query_path}: {e}")
+        logger.error("Unexpected error processing %s: %s", query_path, e)
         return False
@@ -4,12 +4,27 @@ import argparse
 import logging
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from config import find_config_file, get_applicable_files, load_config
-from execute import execute_query
+from cache import ResultCache
+from config import (
+    build_query_index,
+    find_config_file,
+    get_applicable_files,
+    load_config,
+)
+from execute import DEFAULT_COMPRESS_LEVEL, execute_query
 from model import KQLConfig
 from utils import setup_logging
 
+logger = logging.getLogger("kql")
+
+# Cached results older than this are ignored unless overridden
+DEFAULT_CACHE_TTL_SECONDS = 3600
+
+# Each query mostly waits on an Azure CLI subprocess, so threads overlap well
+DEFAULT_MAX_PARALLEL = 16
+
 
 def main() -> None:
     """
@@ -35,6 +50,11 @@ def main() -> None:
         "--schema",
         help="Path to the schema file (default: kql-config-schema.json in repo root)",
     )
+    parser.add_argument(
+        "--skip-validation",
+        action="store_true",
+        help="Skip validating the config file against the schema",
+    )
     parser.add_argument(
         "-l",
         "--log-level",
@@ -42,43 +62,97 @@ def main() -> None:
         default="ERROR",
         help="Set logging level",
     )
+    parser.add_argument(
+        "-p",
+        "--max-parallel",
+        type=int,
+        default=DEFAULT_MAX_PARALLEL,
+        help=f"Maximum number of queries to execute concurrently (default: {DEFAULT_MAX_PARALLEL})",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Folder for caching query results between runs (default: no caching)",
+    )
+    parser.add_argument(
+        "--cache-ttl-seconds",
+        type=float,
+        default=DEFAULT_CACHE_TTL_SECONDS,
+        help=f"Seconds a cached result stays valid (default: {DEFAULT_CACHE_TTL_SECONDS})",
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        default=DEFAULT_COMPRESS_LEVEL,
+        help=f"Compression level for gzip and zip outputs, 0-9 (default: {DEFAULT_COMPRESS_LEVEL})",
+    )
 
     args = parser.parse_args()
+    if args.max_parallel < 1:
+        parser.error("--max-parallel must be at least 1")
+    if args.cache_ttl_seconds <= 0:
+        parser.error("--cache-ttl-seconds must be positive")
+    if not 0 <= args.compress_level <= 9:
+        parser.error("--compress-level must be between 0 and 9")
     setup_logging(getattr(logging, args.log_level))
 
     # Validate folder exists
     folder_path = args.folder
     if not os.path.isdir(folder_path):
-        logging.error(f"Folder {folder_path} does not exist")
+        logger.error("Folder %s does not exist", folder_path)
         sys.exit(1)
 
     # Load configuration
     config_path = args.config or find_config_file(folder_path)
     if config_path:
-        logging.info(f"Using config file: {config_path}")
-        config = load_config(config_path, args.schema)
+        logger.info("Using config file: %s", config_path)
+        config = load_config(config_path, args.schema, args.skip_validation)
     else:
-        logging.info("No config file found, using default JSON output for all queries")
+        logger.info("No config file found, using default JSON output for all queries")
         config = KQLConfig()  # Default config with JSON output to stdout
 
     # Find all KQL files in the folder
     applicable_files = get_applicable_files(folder_path, config)
     if not applicable_files:
-        logging.info("No KQL files found in the specified folder")
+        logger.info("No KQL files found in the specified folder")
         sys.exit(0)
 
-    logging.info(f"Found {len(applicable_files)} KQL file(s) to execute")
+    logger.info("Found %s KQL file(s) to execute", len(applicable_files))
+
+    cache = None
+    if args.cache_dir:
+        logger.info("Caching query results in %s", args.cache_dir)
+        cache = ResultCache(args.cache_dir, args.cache_ttl_seconds)
 
-    # Execute each query
+    # Resolve query file names to output configs once for all queries
+    query_index = build_query_index(config)
+
+    # Execute queries concurrently
     success_count, fail_count = 0, 0
-    for file_name in applicable_files:
-        if execute_query(folder_path, file_name, args.workspace_id, config):
-            success_count += 1
-        else:
-            fail_count += 1
+    max_workers = min(args.max_parallel, len(applicable_files))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                execute_query,
+                folder_path,
+                file_name,
+                args.workspace_id,
+                config,
+                cache,
+                query_index,
+                args.compress_level,
+            )
+            for file_name in applicable_files
+        ]
+        for future in as_completed(futures):
+            if future.result():
+                success_count += 1
+            else:
+                fail_count += 1
 
     # Report results
-    logging.info(f"Execution completed: {success_count} succeeded, {fail_count} failed")
+    logger.info(
+        "Execution completed: %s succeeded, %s failed", success_count, fail_count
+    )
     if fail_count > 0:
         sys.exit(1)
 
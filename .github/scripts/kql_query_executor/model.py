@@ -1,6 +1,10 @@
-from dataclasses import dataclass
+import re
+from dataclasses import dataclass, field
 from enum import Enum
 
+# Finds the first whitespace character in a path, scanning in C
+_HAS_WS = re.compile(r"\s").search
+
 
 class OutputFormat(str, Enum):
     """
@@ -26,15 +30,19 @@ class OutputFormat(str, Enum):
 
     def extension(self) -> str:
         """Returns the file extension for the output format."""
-        return {
-            OutputFormat.NONE: "",
-            OutputFormat.JSON: ".json",
-            OutputFormat.JSONC: ".json",
-            OutputFormat.TABLE: ".txt",
-            OutputFormat.TSV: ".tsv",
-            OutputFormat.YAML: ".yaml",
-            OutputFormat.YAMLC: ".yaml",
-        }.get(self, "")
+        return _EXTENSIONS.get(self, "")
+
+
+# File extension for each output format, built once rather than per call
+_EXTENSIONS = {
+    OutputFormat.NONE: "",
+    OutputFormat.JSON: ".json",
+    OutputFormat.JSONC: ".json",
+    OutputFormat.TABLE: ".txt",
+    OutputFormat.TSV: ".tsv",
+    OutputFormat.YAML: ".yaml",
+    OutputFormat.YAMLC: ".yaml",
+}
 
 
 class CompressionType(str, Enum):
@@ -50,7 +58,7 @@ class CompressionType(str, Enum):
     ZIP = "zip"
 
 
-@dataclass
+@dataclass(slots=True)
 class OutputConfig:
     """
     Configuration for an individual output format.
@@ -69,14 +77,14 @@ class OutputConfig:
 
     def __post_init__(self) -> None:
         # Reject whitespace in filenames
-        if self.file and any(c.isspace() for c in self.file):
+        if self.file and _HAS_WS(self.file):
             raise ValueError(
                 f"Filename should not contain whitespace: '{self.file}'. "
                 f"Use underscores or dashes instead."
             )
 
 
-@dataclass
+@dataclass(slots=True)
 class QueryConfig:
     """
     Configuration for an individual KQL query.
@@ -95,14 +103,14 @@ class QueryConfig:
             raise ValueError(f"Query file must end with .kql: {self.file}")
 
         # Check for whitespace in file path
-        if any(c.isspace() for c in self.file):
+        if _HAS_WS(self.file):
             raise ValueError(
                 f"Query file path should not contain whitespace: '{self.file}'. "
                 f"Use underscores or dashes instead."
             )
 
 
-@dataclass
+@dataclass(slots=True)
 class KQLConfig:
     """
     Root configuration for KQL query execution.
@@ -113,4 +121,4 @@ class KQLConfig:
     """
 
     version: str = "1.0"
-    queries: list[QueryConfig] = None
+    queries: list[QueryConfig] = field(default_factory=list)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Make the executor modules importable from the tests, once per session
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,82 @@
+import os
+import time
+from unittest import mock
+
+import pytest
+
+from cache import ResultCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """Cache stored in a temporary directory."""
+    return ResultCache(str(tmp_path / "cache"), ttl_seconds=60)
+
+
+def test_make_key_is_stable_and_unambiguous():
+    """Test keys depend on every part and on where the parts split."""
+    assert ResultCache.make_key("ws", b"query") == ResultCache.make_key("ws", b"query")
+    assert ResultCache.make_key("ws", "json") != ResultCache.make_key("ws", "jsonc")
+    assert ResultCache.make_key("ab", "c") != ResultCache.make_key("a", "bc")
+
+
+def test_put_then_get(cache, tmp_path):
+    """Test a stored result can be read back."""
+    source = tmp_path / "result"
+    source.write_bytes(b"result data")
+    with open(source, "rb") as f:
+        cache.put("key", f)
+
+    cached = cache.get("key")
+    assert cached is not None
+    with cached:
+        assert cached.read() == b"result data"
+    # No temporary files are left behind
+    assert os.listdir(cache.directory) == ["key.out"]
+
+
+def test_put_failure_removes_temp_file(cache, tmp_path):
+    """Test a failed store leaves no partial file in the cache directory."""
+    source = tmp_path / "result"
+    source.write_bytes(b"result data")
+    with (
+        open(source, "rb") as f,
+        mock.patch("cache.os.replace", side_effect=OSError("No space left")),
+        pytest.raises(OSError, match="No space left"),
+    ):
+        cache.put("key", f)
+
+    assert os.listdir(cache.directory) == []
+
+
+def test_get_missing(cache):
+    """Test a missing entry is a cache miss."""
+    assert cache.get("missing") is None
+
+
+def test_get_unreadable_cache_dir(tmp_path, caplog):
+    """Test an unusable cache directory is a cache miss, not an error."""
+    cache_path = tmp_path / "cache"
+    cache_path.write_bytes(b"not a directory")
+    cache = ResultCache(str(cache_path), ttl_seconds=60)
+
+    assert cache.get("key") is None
+    assert "Could not read cached result" in caplog.text
+
+
+def test_get_expired(cache, tmp_path):
+    """Test entries older than the TTL are ignored."""
+    source = tmp_path / "result"
+    source.write_bytes(b"old data")
+    with open(source, "rb") as f:
+        cache.put("key", f)
+    stale = time.time() - 120
+    os.utime(os.path.join(cache.directory, "key.out"), (stale, stale))
+
+    assert cache.get("key") is None
+
+
+def test_invalid_ttl():
+    """Test a non-positive TTL is rejected."""
+    with pytest.raises(ValueError, match="Cache TTL must be a positive"):
+        ResultCache("cache", ttl_seconds=0)
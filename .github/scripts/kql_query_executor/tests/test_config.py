@@ -1,15 +1,15 @@
+import json
+import logging
 import os
-import sys
-import tempfile
+import re
+from pathlib import Path
 from unittest import mock
 
 import pytest
 import yaml
 
-# Add parent directory to path so we can import modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
 from config import (
+    build_query_index,
     convert_dict_to_config,
     find_config_file,
     get_applicable_files,
@@ -19,134 +19,285 @@ from config import (
 )
 from model import CompressionType, KQLConfig, OutputConfig, OutputFormat, QueryConfig
 
+# Static files used by the tests
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+# Config dictionaries shared by all tests; convert_dict_to_config only reads
+# them, so tests must not modify them
+BASIC_CONFIG_DICT = {
+    "version": "1.0",
+    "queries": [
+        {
+            "file": "test_query.kql",
+            "output": [{"format": "json"}],
+        }
+    ],
+}
+
+COMPLEX_CONFIG_DICT = {
+    "version": "1.0",
+    "queries": [
+        {
+            "file": "test_query.kql",
+            "output": [
+                {"format": "json", "query": "[].{Name: name, Count: count}"},
+                {"format": "json", "file": "results/test_output.json"},
+                {
+                    "format": "json",
+                    "file": "compressed_results/compressed_output.json",
+                    "compression": "gzip",
+                },
+            ],
+        },
+        {
+            "file": "subdir/subdir_query.kql",
+            "output": [{"format": "yaml", "file": "subdir_results/output.yaml"}],
+        },
+    ],
+}
+
+# KQL files in every test directory, and those after
+# test_get_applicable_files_multiple_subdirs adds nested ones
+ALL_KQL_FILES = frozenset({"test_query.kql", "subdir/subdir_query.kql"})
+MULTI_SUBDIR_FILES = ALL_KQL_FILES | frozenset(
+    {
+        "logs/logs_query.kql",
+        "metrics/system/cpu_usage.kql",
+        "metrics/network/network_traffic.kql",
+    }
+)
+
+# Config without specific queries, shared by tests that never modify it
+EMPTY_CONFIG = KQLConfig(version="1.0", queries=[])
+
+# Expected error messages, compiled once for pytest.raises
+RE_MUST_END_KQL = re.compile(r"Query file must end with \.kql")
+RE_FILE_MISSING = re.compile(r"Query file does not exist")
+
+# YAML form of BASIC_CONFIG_DICT
+BASIC_CONFIG_YAML = b"""\
+version: '1.0'
+queries:
+  - file: test_query.kql
+    output:
+      - format: json
+"""
+
+# Config missing the required 'file' field of a query
+INVALID_CONFIG_YAML = b"""\
+version: '1.0'
+queries:
+  - output:
+    - format: json
+"""
+
+
+# Files in every test directory: two KQL files, one in a subdirectory, and a
+# non-KQL file
+TEST_FILES = [
+    ("test_query.kql", b"// Test KQL query\nTable | take 10"),
+    ("test_file.txt", b"This is not a KQL file"),
+    (
+        "subdir/subdir_query.kql",
+        b"// Subdirectory KQL query\nTable | where Column == 'value'",
+    ),
+]
+
+
+def create_test_files(temp_dir: str) -> None:
+    """Create the KQL and non-KQL test files in a directory."""
+    os.makedirs(os.path.join(temp_dir, "subdir"), exist_ok=True)
+    for rel_path, content in TEST_FILES:
+        Path(temp_dir, rel_path).write_bytes(content)
+
+
+@pytest.fixture(scope="session")
+def temp_dir_with_files(tmp_path_factory):
+    """
+    Create a temporary directory with test files, shared by all tests.
+
+    Tests must not modify it; use mutable_temp_dir to add files. Under
+    pytest-xdist every worker builds its own copy in its own base directory.
+    """
+    temp_dir = str(tmp_path_factory.mktemp("kql_root"))
+    create_test_files(temp_dir)
+    return temp_dir
+
 
 @pytest.fixture
-def temp_dir_with_files():
-    """Create a temporary directory with test files."""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Create a KQL file
-        kql_file = os.path.join(temp_dir, "test_query.kql")
-        with open(kql_file, "w") as f:
-            f.write("// Test KQL query\nTable | take 10")
+def mutable_temp_dir(tmp_path):
+    """Create a per-test temporary directory with the same test files."""
+    create_test_files(str(tmp_path))
+    return str(tmp_path)
 
-        # Create a non-KQL file
-        txt_file = os.path.join(temp_dir, "test_file.txt")
-        with open(txt_file, "w") as f:
-            f.write("This is not a KQL file")
 
-        # Create a subdirectory with another KQL file
-        subdir = os.path.join(temp_dir, "subdir")
-        os.makedirs(subdir)
-        sub_kql_file = os.path.join(subdir, "subdir_query.kql")
-        with open(sub_kql_file, "w") as f:
-            f.write("// Subdirectory KQL query\nTable | where Column == 'value'")
+@pytest.fixture(scope="session")
+def object_schema_path(tmp_path_factory):
+    """
+    Write a schema accepting any object once for the whole session.
 
-        yield temp_dir
+    The validator compiled for it is cached by config, so tests sharing this
+    path only pay for schema loading once.
+    """
+    schema_path = tmp_path_factory.mktemp("schema") / "schema.json"
+    schema_path.write_bytes(b'{"type":"object"}')
+    return str(schema_path)
 
 
 @pytest.fixture
 def basic_config_dict():
     """Return a basic configuration dictionary."""
-    return {
-        "version": "1.0",
+    return BASIC_CONFIG_DICT
+
+
+@pytest.fixture
+def complex_config_dict():
+    """Return a complex configuration dictionary with multiple outputs and compression."""
+    return COMPLEX_CONFIG_DICT
+
+
+@pytest.mark.parametrize("config_name", [".kql-config.yaml", ".kql-config.yml", None])
+def test_find_config_file(mutable_temp_dir, config_name):
+    """Test finding a .yaml or .yml config file in the folder, or none at all."""
+    config_path = None
+    if config_name:
+        config_path = os.path.join(mutable_temp_dir, config_name)
+        Path(config_path).write_bytes(b"version: '1.0'")
+
+    # Point the repo root elsewhere so the real config file is not found
+    found_path = find_config_file(mutable_temp_dir, repo_root=Path("/nonexistent"))
+    assert found_path == config_path
+
+
+def test_find_config_file_in_repo_root(temp_dir_with_files, mutable_temp_dir):
+    """Test falling back to a config file in the repository root."""
+    config_path = os.path.join(mutable_temp_dir, ".kql-config.yml")
+    Path(config_path).write_bytes(b"version: '1.0'")
+
+    found_path = find_config_file(temp_dir_with_files, repo_root=Path(mutable_temp_dir))
+    assert found_path == config_path
+
+
+@pytest.mark.parametrize(
+    "file_path, error",
+    [
+        ("test_query.kql", None),
+        ("subdir/subdir_query.kql", None),
+        ("nonexistent.kql", RE_FILE_MISSING),
+    ],
+)
+def test_validate_file_path(temp_dir_with_files, file_path, error):
+    """Test validating existing and missing file paths."""
+    if error is None:
+        assert validate_file_path(file_path, temp_dir_with_files) == file_path
+    else:
+        with pytest.raises(ValueError, match=error):
+            validate_file_path(file_path, temp_dir_with_files)
+
+
+@mock.patch("config.os.stat")
+def test_validate_file_path_not_kql(mock_stat):
+    """Test the .kql check rejects a path without touching the filesystem."""
+    with pytest.raises(ValueError, match=RE_MUST_END_KQL):
+        validate_file_path("test_file.txt", "/nonexistent")
+
+    mock_stat.assert_not_called()
+
+
+def test_validate_file_path_directory(mutable_temp_dir):
+    """Test validating a .kql path that is a directory."""
+    os.makedirs(os.path.join(mutable_temp_dir, "folder.kql"))
+    with pytest.raises(ValueError, match=RE_FILE_MISSING):
+        validate_file_path("folder.kql", mutable_temp_dir)
+
+
+def test_convert_dict_to_config_output_paths(temp_dir_with_files, caplog):
+    """Test existing output files and missing output directories are reported."""
+    caplog.set_level(logging.INFO)
+    config_dict = {
         "queries": [
             {
                 "file": "test_query.kql",
-                "output": [{"format": "json"}],
+                "output": [
+                    {"format": "json", "file": "test_file.txt"},
+                    {"format": "json", "file": "new_dir/output.json"},
+                ],
             }
-        ],
+        ]
     }
 
+    convert_dict_to_config(config_dict, temp_dir_with_files)
 
-@pytest.fixture
-def complex_config_dict():
-    """Return a complex configuration dictionary with multiple outputs and compression."""
-    return {
-        "version": "1.0",
+    assert "Output file exists and will be overwritten: test_file.txt" in caplog.text
+    assert "Directory does not exist and will be created" in caplog.text
+    assert "new_dir" in caplog.text
+
+
+def test_convert_dict_to_config_shared_output_checked_once(temp_dir_with_files, caplog):
+    """Test an output file shared by several outputs is only reported once."""
+    config_dict = {
         "queries": [
             {
                 "file": "test_query.kql",
                 "output": [
-                    {"format": "json", "query": "[].{Name: name, Count: count}"},
-                    {"format": "json", "file": "results/test_output.json"},
-                    {
-                        "format": "json",
-                        "file": "compressed_results/compressed_output.json",
-                        "compression": "gzip",
-                    },
+                    {"format": "json", "file": "test_file.txt"},
+                    {"format": "json", "file": "test_file.txt", "compression": "gzip"},
                 ],
             },
             {
                 "file": "subdir/subdir_query.kql",
-                "output": [{"format": "yaml", "file": "subdir_results/output.yaml"}],
+                "output": [{"format": "yaml", "file": "test_file.txt"}],
             },
-        ],
+        ]
     }
 
+    convert_dict_to_config(config_dict, temp_dir_with_files)
 
-def test_find_config_file_in_folder(temp_dir_with_files):
-    """Test finding a config file in the specified folder."""
-    # Create config file in the temp directory
-    config_path = os.path.join(temp_dir_with_files, ".kql-config.yaml")
-    with open(config_path, "w") as f:
-        f.write("version: '1.0'")
-
-    # Test finding the config file
-    found_path = find_config_file(temp_dir_with_files)
-    assert found_path == config_path
+    assert caplog.text.count("Output file exists and will be overwritten") == 1
 
 
-def test_find_config_file_yml_extension(temp_dir_with_files):
-    """Test finding a config file with .yml extension."""
-    # Create config file with .yml extension
-    config_path = os.path.join(temp_dir_with_files, ".kql-config.yml")
-    with open(config_path, "w") as f:
-        f.write("version: '1.0'")
-
-    # Test finding the config file
-    found_path = find_config_file(temp_dir_with_files)
-    assert found_path == config_path
-
-
-@mock.patch("config.Path")
-def test_find_config_file_not_found(mock_path, temp_dir_with_files):
-    """Test behavior when config file is not found."""
-    # Mock repo_root path to ensure it doesn't find a real config file
-    mock_repo_root = mock.MagicMock()
-    mock_path.return_value.parent.parent.parent.parent = mock_repo_root
-    mock_repo_root.__truediv__.return_value.exists.return_value = False
-
-    # No config file created
-    found_path = find_config_file(temp_dir_with_files)
-    assert found_path is None
-
-
-def test_validate_file_path_valid(temp_dir_with_files):
-    """Test validating a valid KQL file path."""
-    file_path = "test_query.kql"
-    result = validate_file_path(file_path, temp_dir_with_files)
-    assert result == file_path
+@mock.patch("config.sys.exit")
+def test_convert_dict_to_config_output_under_file(
+    mock_exit, temp_dir_with_files, caplog
+):
+    """Test an output path below an existing file does not fail loading."""
+    config_dict = {
+        "queries": [
+            {
+                "file": "test_query.kql",
+                "output": [{"format": "json", "file": "test_file.txt/out.json"}],
+            }
+        ]
+    }
 
+    config = convert_dict_to_config(config_dict, temp_dir_with_files)
 
-def test_validate_file_path_not_kql(temp_dir_with_files):
-    """Test validating a file path that doesn't end with .kql."""
-    file_path = "test_file.txt"
-    with pytest.raises(ValueError, match="Query file must end with .kql"):
-        validate_file_path(file_path, temp_dir_with_files)
+    mock_exit.assert_not_called()
+    assert config.queries[0].output[0].file == "test_file.txt/out.json"
+    assert "will be created" not in caplog.text
 
 
-def test_validate_file_path_not_exist(temp_dir_with_files):
-    """Test validating a file path that doesn't exist."""
-    file_path = "nonexistent.kql"
-    with pytest.raises(ValueError, match="Query file does not exist"):
-        validate_file_path(file_path, temp_dir_with_files)
+@mock.patch("config.sys.exit")
+def test_convert_dict_to_config_whitespace_output(
+    mock_exit, temp_dir_with_files, caplog
+):
+    """Test output file paths with whitespace are rejected before any stat."""
+    config_dict = {
+        "queries": [
+            {
+                "file": "test_query.kql",
+                "output": [{"format": "json", "file": "my output.json"}],
+            }
+        ]
+    }
 
+    with mock.patch("config.os.stat", wraps=os.stat) as mock_stat:
+        convert_dict_to_config(config_dict, temp_dir_with_files)
 
-def test_validate_file_path_in_subdir(temp_dir_with_files):
-    """Test validating a file path in a subdirectory."""
-    file_path = "subdir/subdir_query.kql"
-    result = validate_file_path(file_path, temp_dir_with_files)
-    assert result == file_path
+    mock_exit.assert_called_once_with(1)
+    assert "Filename should not contain whitespace" in caplog.text
+    # Only the query file was checked on disk
+    mock_stat.assert_called_once()
 
 
 def test_convert_dict_to_config_invalid_file(temp_dir_with_files):
@@ -224,21 +375,14 @@ def test_convert_dict_to_config_empty():
     assert config.queries == []
 
 
-@mock.patch("config.jsonschema.validate")
-def test_load_config_valid(mock_validate, temp_dir_with_files, basic_config_dict):
+def test_load_config_valid(mutable_temp_dir, object_schema_path):
     """Test loading a valid configuration file."""
     # Create a valid config file
-    config_path = os.path.join(temp_dir_with_files, ".kql-config.yaml")
-    with open(config_path, "w") as f:
-        yaml.dump(basic_config_dict, f)
-
-    # Create a mock schema file
-    schema_path = os.path.join(temp_dir_with_files, "schema.json")
-    with open(schema_path, "w") as f:
-        f.write('{"type":"object"}')
+    config_path = os.path.join(mutable_temp_dir, ".kql-config.yaml")
+    Path(config_path).write_bytes(BASIC_CONFIG_YAML)
 
     # Load the config
-    config = load_config(config_path, schema_path)
+    config = load_config(config_path, object_schema_path)
 
     # Verify the config was loaded correctly
     assert isinstance(config, KQLConfig)
@@ -247,40 +391,53 @@ def test_load_config_valid(mock_validate, temp_dir_with_files, basic_config_dict
     assert config.queries[0].file == "test_query.kql"
 
 
+def test_load_config_reuses_schema_validator(mutable_temp_dir):
+    """Test that the schema is read and compiled once across config loads."""
+    config_path = os.path.join(mutable_temp_dir, ".kql-config.yaml")
+    Path(config_path).write_bytes(BASIC_CONFIG_YAML)
+
+    schema_path = os.path.join(mutable_temp_dir, "schema.json")
+    Path(schema_path).write_bytes(b'{"type":"object"}')
+
+    # Load the same config twice with the same schema
+    with mock.patch("config.json.load", wraps=json.load) as mock_json_load:
+        load_config(config_path, schema_path)
+        load_config(config_path, schema_path)
+
+    # Verify the schema file was only parsed once
+    mock_json_load.assert_called_once()
+
+
+def test_load_config_reloads_edited_config(mutable_temp_dir):
+    """Test that an unchanged config is parsed once and an edited one again."""
+    config_path = os.path.join(mutable_temp_dir, ".kql-config.yaml")
+    Path(config_path).write_bytes(BASIC_CONFIG_YAML)
+
+    with mock.patch("yaml.load", wraps=yaml.load) as mock_yaml_load:
+        load_config(config_path, skip_validation=True)
+        load_config(config_path, skip_validation=True)
+        mock_yaml_load.assert_called_once()
+
+        # Edit the config and move its modification time forward
+        Path(config_path).write_bytes(BASIC_CONFIG_YAML.replace(b"'1.0'", b"'2.0'"))
+        stat = os.stat(config_path)
+        os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        config = load_config(config_path, skip_validation=True)
+
+    assert mock_yaml_load.call_count == 2
+    assert config.version == "2.0"
+
+
 @mock.patch("config.sys.exit")
-def test_load_config_validation_error(mock_exit, temp_dir_with_files):
+def test_load_config_validation_error(mock_exit, mutable_temp_dir):
     """Test loading a config that fails schema validation."""
     # Create an invalid config file (missing required 'file' field)
-    config_path = os.path.join(temp_dir_with_files, "invalid_config.yaml")
-    with open(config_path, "w") as f:
-        f.write(
-            """
-        version: '1.0'
-        queries:
-          - output:
-            - format: json
-        """
-        )
-
-    # Define a mock schema that requires 'file' field
-    schema_path = os.path.join(temp_dir_with_files, "schema.json")
-    with open(schema_path, "w") as f:
-        f.write(
-            """
-        {
-          "type": "object",
-          "properties": {
-            "queries": {
-              "type": "array",
-              "items": {
-                "type": "object",
-                "required": ["file"]
-              }
-            }
-          }
-        }
-        """
-        )
+    config_path = os.path.join(mutable_temp_dir, "invalid_config.yaml")
+    Path(config_path).write_bytes(INVALID_CONFIG_YAML)
+
+    # Use a schema that requires the 'file' field
+    schema_path = str(FIXTURES_DIR / "require_file.schema.json")
 
     # This should fail validation and exit
     load_config(config_path, schema_path)
@@ -289,6 +446,21 @@ def test_load_config_validation_error(mock_exit, temp_dir_with_files):
     mock_exit.assert_called_once()
 
 
+@mock.patch("config._get_validator")
+def test_load_config_skip_validation(mock_get_validator, mutable_temp_dir):
+    """Test that schema validation can be skipped entirely."""
+    config_path = os.path.join(mutable_temp_dir, ".kql-config.yaml")
+    Path(config_path).write_bytes(BASIC_CONFIG_YAML)
+
+    # Load the config without validation
+    config = load_config(config_path, skip_validation=True)
+
+    # Verify the config was loaded without touching the schema
+    mock_get_validator.assert_not_called()
+    assert len(config.queries) == 1
+    assert config.queries[0].file == "test_query.kql"
+
+
 @mock.patch("config.sys.exit")
 def test_load_config_file_not_found(mock_exit):
     """Test loading a config file that doesn't exist."""
@@ -298,123 +470,90 @@ def test_load_config_file_not_found(mock_exit):
     mock_exit.assert_called_once()
 
 
-def test_get_applicable_files_no_config(temp_dir_with_files):
-    """Test getting applicable files when no queries are configured."""
-    # Create empty config
-    config = KQLConfig(version="1.0", queries=[])
-
-    # Get applicable files
-    files = get_applicable_files(temp_dir_with_files, config)
-
-    # Should return all KQL files in the directory and subdirectories
-    assert len(files) == 2
-    assert "test_query.kql" in files
-    assert "subdir/subdir_query.kql" in files
-
-
-def test_get_applicable_files_with_config(temp_dir_with_files):
-    """Test getting applicable files from configuration."""
-    # Create config with specific queries
+@pytest.mark.parametrize(
+    "query_files, expected",
+    [
+        # No queries configured: every KQL file in the folder and subfolders
+        ([], ALL_KQL_FILES),
+        (["test_query.kql"], frozenset({"test_query.kql"})),
+        (["subdir/subdir_query.kql"], frozenset({"subdir/subdir_query.kql"})),
+        # Missing files are skipped
+        (["nonexistent.kql"], frozenset()),
+    ],
+)
+def test_get_applicable_files(temp_dir_with_files, query_files, expected):
+    """Test getting applicable files with and without configured queries."""
     config = KQLConfig(
         version="1.0",
         queries=[
-            QueryConfig(
-                file="test_query.kql", output=[OutputConfig(format=OutputFormat.JSON)]
-            )
+            QueryConfig(file=file, output=[OutputConfig(format=OutputFormat.JSON)])
+            for file in query_files
         ],
     )
 
-    # Get applicable files
     files = get_applicable_files(temp_dir_with_files, config)
 
-    # Should return only the specified file
-    assert len(files) == 1
-    assert "test_query.kql" in files
+    assert len(files) == len(expected)
+    assert set(files) == expected
 
 
-def test_get_applicable_files_with_subdir_config(temp_dir_with_files):
-    """Test getting applicable files with subdirectory paths."""
-    # Create config with file in subdirectory
+def test_get_applicable_files_duplicate_entries(temp_dir_with_files):
+    """Test that a file listed several times in the config is returned once."""
+    # Create config listing the same file twice
     config = KQLConfig(
         version="1.0",
         queries=[
+            QueryConfig(
+                file="test_query.kql", output=[OutputConfig(format=OutputFormat.JSON)]
+            ),
             QueryConfig(
                 file="subdir/subdir_query.kql",
                 output=[OutputConfig(format=OutputFormat.JSON)],
-            )
-        ],
-    )
-
-    # Get applicable files
-    files = get_applicable_files(temp_dir_with_files, config)
-
-    # Should return only the specified file
-    assert len(files) == 1
-    assert "subdir/subdir_query.kql" in files
-
-
-def test_get_applicable_files_invalid_path(temp_dir_with_files):
-    """Test getting applicable files with an invalid path in config."""
-    # Create config with invalid file path
-    config = KQLConfig(
-        version="1.0",
-        queries=[
+            ),
             QueryConfig(
-                file="nonexistent.kql", output=[OutputConfig(format=OutputFormat.JSON)]
-            )
+                file="test_query.kql", output=[OutputConfig(format=OutputFormat.YAML)]
+            ),
         ],
     )
 
     # Get applicable files
     files = get_applicable_files(temp_dir_with_files, config)
 
-    # Should return empty list since the path is invalid
-    assert len(files) == 0
+    # Should return each file once, in config order
+    assert files == ["test_query.kql", "subdir/subdir_query.kql"]
 
 
-def test_get_applicable_files_multiple_subdirs(temp_dir_with_files):
+def test_get_applicable_files_multiple_subdirs(mutable_temp_dir):
     """Test getting applicable files from multiple nested subdirectories."""
     # Create multiple nested subdirectories with KQL files
-    nested_dir1 = os.path.join(temp_dir_with_files, "logs")
-    os.makedirs(nested_dir1)
-    nested_kql1 = os.path.join(nested_dir1, "logs_query.kql")
-    with open(nested_kql1, "w") as f:
-        f.write("// Logs KQL query\nLogs | where Level == 'Error'")
-
-    nested_dir2 = os.path.join(temp_dir_with_files, "metrics", "system")
-    os.makedirs(nested_dir2)
-    nested_kql2 = os.path.join(nested_dir2, "cpu_usage.kql")
-    with open(nested_kql2, "w") as f:
-        f.write("// CPU usage query\nPerf | where CounterName == 'CPU'")
-
-    nested_dir3 = os.path.join(temp_dir_with_files, "metrics", "network")
-    os.makedirs(nested_dir3)
-    nested_kql3 = os.path.join(nested_dir3, "network_traffic.kql")
-    with open(nested_kql3, "w") as f:
-        f.write("// Network traffic query\nPerf | where CounterName == 'Network'")
-
-    # Create empty config (no specific queries)
-    config = KQLConfig(version="1.0", queries=[])
-
-    # Get applicable files
-    files = get_applicable_files(temp_dir_with_files, config)
-
-    # Should find all KQL files in all subdirectories
-    assert len(files) == 5  # 2 original + 3 new
-
-    # Original files
-    assert "test_query.kql" in files
-    assert "subdir/subdir_query.kql" in files
-
-    # Files in new subdirectories
-    assert "logs/logs_query.kql" in files
-    assert "metrics/system/cpu_usage.kql" in files
-    assert "metrics/network/network_traffic.kql" in files
-
-
-def test_get_output_configs_for_query(temp_dir_with_files):
-    """Test getting output configs for a specific query."""
-    config = KQLConfig(
+    nested_files = [
+        ("logs/logs_query.kql", b"// Logs KQL query\nLogs | where Level == 'Error'"),
+        (
+            "metrics/system/cpu_usage.kql",
+            b"// CPU usage query\nPerf | where CounterName == 'CPU'",
+        ),
+        (
+            "metrics/network/network_traffic.kql",
+            b"// Network traffic query\nPerf | where CounterName == 'Network'",
+        ),
+    ]
+    for rel_path, content in nested_files:
+        nested_kql = Path(mutable_temp_dir, rel_path)
+        nested_kql.parent.mkdir(parents=True, exist_ok=True)
+        nested_kql.write_bytes(content)
+
+    # Get applicable files with no specific queries configured
+    files = get_applicable_files(mutable_temp_dir, EMPTY_CONFIG)
+
+    # Should find all KQL files in all subdirectories, each once
+    assert len(files) == len(MULTI_SUBDIR_FILES)
+    assert set(files) == MULTI_SUBDIR_FILES
+
+
+@pytest.fixture(scope="module")
+def output_config():
+    """Return a config with specific outputs for the two test queries."""
+    return KQLConfig(
         version="1.0",
         queries=[
             QueryConfig(
@@ -436,36 +575,57 @@ def test_get_output_configs_for_query(temp_dir_with_files):
         ],
     )
 
-    # Get output config for the first query
-    configs1 = get_output_configs_for_query(config, "test_query.kql")
-    assert len(configs1) == 1
-    assert configs1[0].format == OutputFormat.JSON
-    assert configs1[0].query == "[].{Name: name, Count: count}"
 
-    # Get output config for the second query
-    configs2 = get_output_configs_for_query(config, "subdir_query.kql")
-    assert len(configs2) == 1
-    assert configs2[0].format == OutputFormat.YAML
-    assert configs2[0].file == "custom_dir/output.yaml"
+@pytest.mark.parametrize(
+    "file, expected",
+    [
+        (
+            "test_query.kql",
+            OutputConfig(
+                format=OutputFormat.JSON, query="[].{Name: name, Count: count}"
+            ),
+        ),
+        # Matched by file name
+        (
+            "subdir_query.kql",
+            OutputConfig(format=OutputFormat.YAML, file="custom_dir/output.yaml"),
+        ),
+        # Same file name in another directory: not a match
+        ("other/test_query.kql", OutputConfig(format=OutputFormat.JSON)),
+        # Not in the config: default JSON output to the console
+        ("different.kql", OutputConfig(format=OutputFormat.JSON)),
+    ],
+)
+def test_get_output_configs_for_query(output_config, file, expected):
+    """Test getting the output configs for configured and unknown queries."""
+    assert get_output_configs_for_query(output_config, file) == [expected]
 
 
-def test_get_output_configs_default(temp_dir_with_files):
-    """Test getting default output config when no matching query found."""
+def test_build_query_index():
+    """Test the query index resolves paths, suffixes and file names."""
+    yaml_output = [OutputConfig(format=OutputFormat.YAML)]
+    table_output = [OutputConfig(format=OutputFormat.TABLE)]
     config = KQLConfig(
         version="1.0",
         queries=[
-            QueryConfig(
-                file="different.kql",
-                output=[
-                    OutputConfig(format=OutputFormat.YAML, file="results/output.yaml")
-                ],
-            )
+            QueryConfig(file="metrics/system/cpu_usage.kql", output=None),
+            QueryConfig(file="metrics/system/cpu_usage.kql", output=yaml_output),
+            QueryConfig(file="logs/cpu_usage.kql", output=table_output),
         ],
     )
 
-    # Get output config for a query not in the config
-    configs = get_output_configs_for_query(config, "test_query.kql")
+    index = build_query_index(config)
+
+    # Every path suffix resolves, and the first query with outputs wins
+    assert index["metrics/system/cpu_usage.kql"] is yaml_output
+    assert index["system/cpu_usage.kql"] is yaml_output
+    assert index["cpu_usage.kql"] is yaml_output
+    assert index["logs/cpu_usage.kql"] is table_output
+
+    # Lookups through a prebuilt index match lookups without one
+    configs = get_output_configs_for_query(config, "logs/cpu_usage.kql", index)
+    assert configs is table_output
 
-    # Should get default JSON output
-    assert len(configs) == 1
+    # Partial file names no longer match by substring
+    configs = get_output_configs_for_query(config, "usage.kql", index)
     assert configs[0].format == OutputFormat.JSON
@@ -1,17 +1,43 @@
 import logging
 import os
 import subprocess
-import sys
+import threading
 from unittest import mock
 
 import pytest
 
-# Add parent directory to path so we can import modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
+import execute
+from cache import ResultCache
 from execute import execute_query
 from model import CompressionType, KQLConfig, OutputConfig, OutputFormat, QueryConfig
 
+# Config without specific queries; output configs are mocked in most tests
+EMPTY_CONFIG = KQLConfig()
+
+
+def fake_az(output: str, returncode: int = 0, stderr: str = ""):
+    """Return a subprocess.run replacement that writes az output to stdout."""
+
+    def run(cmd, **kwargs):
+        kwargs["stdout"].write(output.encode())
+        return subprocess.CompletedProcess(cmd, returncode, stderr=stderr)
+
+    return run
+
+
+@pytest.fixture(autouse=True)
+def reset_ensured_dirs():
+    """Forget output directories created by previous tests."""
+    execute._ensured_dirs.clear()
+    yield
+    execute._ensured_dirs.clear()
+
+
+@pytest.fixture(autouse=True)
+def run_in_tmp_path(tmp_path, monkeypatch):
+    """Write relative output paths of unmocked tests under a temporary dir."""
+    monkeypatch.chdir(tmp_path)
+
 
 @pytest.fixture
 def basic_config():
@@ -40,16 +66,14 @@ def test_basic_execution_to_console(mock_get_configs, mock_subprocess_run, caplo
     """Test basic execution with JSON output to console."""
     # Setup mocks
     mock_get_configs.return_value = [OutputConfig(format=OutputFormat.JSON)]
-    mock_subprocess_run.return_value = mock.MagicMock(
-        stdout="test output", stderr="", returncode=0
-    )
+    mock_subprocess_run.side_effect = fake_az("test output")
 
     # Execute query
     result = execute_query(
         folder_path="/test",
         file_path="query.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
@@ -61,6 +85,67 @@ def test_basic_execution_to_console(mock_get_configs, mock_subprocess_run, caplo
     assert "--query" not in cmd  # No JMESPath query
 
 
+@mock.patch("execute.subprocess.run")
+@mock.patch("execute.get_output_configs_for_query")
+def test_console_output_block(mock_get_configs, mock_subprocess_run, capsys):
+    """Test that console results are printed as a single titled block."""
+    # Setup mocks
+    mock_get_configs.return_value = [OutputConfig(format=OutputFormat.TABLE)]
+    mock_subprocess_run.side_effect = fake_az("Name  Count\n----  -----\nfoo   1\n")
+
+    # Execute query
+    result = execute_query(
+        folder_path="/test",
+        file_path="query.kql",
+        workspace_id="test-workspace",
+        config=EMPTY_CONFIG,
+    )
+
+    # Verify
+    assert result is True
+    assert capsys.readouterr().out == (
+        "Results for query.kql\n"
+        + "-" * 80
+        + "\nName  Count\n----  -----\nfoo   1\n\n\n"
+    )
+
+
+@mock.patch("execute.subprocess.run")
+@mock.patch("execute.get_output_configs_for_query")
+def test_az_telemetry_disabled(mock_get_configs, mock_subprocess_run, monkeypatch):
+    """Test that az runs with telemetry disabled unless the user set it."""
+    # Setup mocks
+    mock_get_configs.return_value = [OutputConfig(format=OutputFormat.JSON)]
+    mock_subprocess_run.side_effect = fake_az("test output")
+    monkeypatch.delenv("AZURE_CORE_COLLECT_TELEMETRY", raising=False)
+    monkeypatch.setenv("AZURE_CONFIG_DIR", "/tmp/azure")
+
+    # Execute query
+    result = execute_query(
+        folder_path="/test",
+        file_path="query.kql",
+        workspace_id="test-workspace",
+        config=EMPTY_CONFIG,
+    )
+
+    # Verify the environment is inherited with telemetry turned off
+    assert result is True
+    env = mock_subprocess_run.call_args.kwargs["env"]
+    assert env["AZURE_CORE_COLLECT_TELEMETRY"] == "false"
+    assert env["AZURE_CONFIG_DIR"] == "/tmp/azure"
+
+    # An explicit user setting wins
+    monkeypatch.setenv("AZURE_CORE_COLLECT_TELEMETRY", "true")
+    execute_query(
+        folder_path="/test",
+        file_path="query.kql",
+        workspace_id="test-workspace",
+        config=EMPTY_CONFIG,
+    )
+    env = mock_subprocess_run.call_args.kwargs["env"]
+    assert env["AZURE_CORE_COLLECT_TELEMETRY"] == "true"
+
+
 @mock.patch("execute.subprocess.run")
 @mock.patch("execute.get_output_configs_for_query")
 @mock.patch("os.makedirs")
@@ -73,16 +158,14 @@ def test_output_to_file(
     mock_get_configs.return_value = [
         OutputConfig(format=OutputFormat.JSON, file="results/output.json")
     ]
-    mock_subprocess_run.return_value = mock.MagicMock(
-        stdout="test output", stderr="", returncode=0
-    )
+    mock_subprocess_run.side_effect = fake_az("test output")
 
     # Execute query
     result = execute_query(
         folder_path="/test",
         file_path="query.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
@@ -90,8 +173,38 @@ def test_output_to_file(
     mock_makedirs.assert_called_once_with(
         os.path.dirname("results/output.json"), exist_ok=True
     )
-    mock_open.assert_called_once_with("results/output.json", "w")
-    mock_open().write.assert_called_once_with("test output")
+    mock_open.assert_called_once_with("results/output.json", "wb")
+    mock_open().write.assert_called_once_with(b"test output")
+
+
+@mock.patch("execute.subprocess.run")
+@mock.patch("execute.get_output_configs_for_query")
+@mock.patch("os.makedirs")
+@mock.patch("builtins.open", new_callable=mock.mock_open)
+def test_output_directories_created_once(
+    mock_open, mock_makedirs, mock_get_configs, mock_subprocess_run
+):
+    """Test that each output directory is created at most once."""
+    # Setup mocks
+    mock_get_configs.return_value = [
+        OutputConfig(format=OutputFormat.JSON, file="alerts/critical.json"),
+        OutputConfig(format=OutputFormat.TSV, file="alerts/critical.tsv"),
+        OutputConfig(format=OutputFormat.YAML, file="summary.yaml"),
+    ]
+    mock_subprocess_run.side_effect = fake_az("test output")
+
+    # Execute query
+    result = execute_query(
+        folder_path="/test",
+        file_path="query.kql",
+        workspace_id="test-workspace",
+        config=EMPTY_CONFIG,
+    )
+
+    # Verify the shared directory is created once and the current one never
+    assert result is True
+    mock_makedirs.assert_called_once_with("alerts", exist_ok=True)
+    mock_open.assert_any_call("summary.yaml", "wb")
 
 
 @mock.patch("execute.subprocess.run")
@@ -109,7 +222,7 @@ def test_format_none_skips_execution(mock_get_configs, mock_subprocess_run, capl
         folder_path="/test",
         file_path="query.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
@@ -118,42 +231,38 @@ def test_format_none_skips_execution(mock_get_configs, mock_subprocess_run, capl
     assert "Skipping output for" in caplog.text
 
 
-@mock.patch("execute.subprocess.run")
-@mock.patch("execute.get_output_configs_for_query")
-def test_all_output_formats(mock_get_configs, mock_subprocess_run):
-    """Test all available output formats."""
-    formats = [
+@pytest.mark.parametrize(
+    "fmt",
+    [
         OutputFormat.JSON,
         OutputFormat.JSONC,
         OutputFormat.TABLE,
         OutputFormat.TSV,
         OutputFormat.YAML,
         OutputFormat.YAMLC,
-    ]
-
-    # Execute each format
-    for fmt in formats:
-        # Reset mocks
-        mock_subprocess_run.reset_mock()
-        mock_get_configs.return_value = [OutputConfig(format=fmt)]
-        mock_subprocess_run.return_value = mock.MagicMock(
-            stdout=f"test {fmt.value} output", stderr="", returncode=0
-        )
+    ],
+)
+@mock.patch("execute.subprocess.run")
+@mock.patch("execute.get_output_configs_for_query")
+def test_all_output_formats(mock_get_configs, mock_subprocess_run, fmt):
+    """Test all available output formats."""
+    mock_get_configs.return_value = [OutputConfig(format=fmt)]
+    mock_subprocess_run.side_effect = fake_az(f"test {fmt.value} output")
 
-        # Execute query
-        result = execute_query(
-            folder_path="/test",
-            file_path="query.kql",
-            workspace_id="test-workspace",
-            config=KQLConfig(),
-        )
+    # Execute query
+    result = execute_query(
+        folder_path="/test",
+        file_path="query.kql",
+        workspace_id="test-workspace",
+        config=EMPTY_CONFIG,
+    )
 
-        # Verify
-        assert result is True
-        mock_subprocess_run.assert_called_once()
-        cmd = mock_subprocess_run.call_args[0][0]
-        assert "--output" in cmd
-        assert fmt.value in cmd
+    # Verify
+    assert result is True
+    mock_subprocess_run.assert_called_once()
+    cmd = mock_subprocess_run.call_args[0][0]
+    assert "--output" in cmd
+    assert fmt.value in cmd
 
 
 @mock.patch("execute.subprocess.run")
@@ -164,16 +273,14 @@ def test_jmespath_query(mock_get_configs, mock_subprocess_run):
     mock_get_configs.return_value = [
         OutputConfig(format=OutputFormat.JSON, query="length(@)")
     ]
-    mock_subprocess_run.return_value = mock.MagicMock(
-        stdout="5", stderr="", returncode=0
-    )
+    mock_subprocess_run.side_effect = fake_az("5")
 
     # Execute query
     result = execute_query(
         folder_path="/test",
         file_path="query.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
@@ -183,6 +290,33 @@ def test_jmespath_query(mock_get_configs, mock_subprocess_run):
     assert "length(@)" in cmd
 
 
+@mock.patch("execute.subprocess.run")
+@mock.patch("execute.get_output_configs_for_query")
+def test_jmespath_query_whitespace_collapsed(mock_get_configs, mock_subprocess_run):
+    """Test multi-line JMESPath queries are passed to az on a single line."""
+    # Setup mocks
+    mock_get_configs.return_value = [
+        OutputConfig(
+            format=OutputFormat.JSON,
+            query="\n  [?severity=='high']\n\t|   length(@)\n",
+        )
+    ]
+    mock_subprocess_run.side_effect = fake_az("5")
+
+    # Execute query
+    result = execute_query(
+        folder_path="/test",
+        file_path="query.kql",
+        workspace_id="test-workspace",
+        config=EMPTY_CONFIG,
+    )
+
+    # Verify
+    assert result is True
+    cmd = mock_subprocess_run.call_args[0][0]
+    assert cmd[cmd.index("--query") + 1] == "[?severity=='high'] | length(@)"
+
+
 @mock.patch("execute.subprocess.run")
 @mock.patch("execute.get_output_configs_for_query")
 def test_jmespath_error_handling(mock_get_configs, mock_subprocess_run, caplog):
@@ -191,8 +325,8 @@ def test_jmespath_error_handling(mock_get_configs, mock_subprocess_run, caplog):
     mock_get_configs.return_value = [
         OutputConfig(format=OutputFormat.JSON, query="invalid[query")
     ]
-    mock_subprocess_run.side_effect = subprocess.CalledProcessError(
-        1, "az monitor", stderr="JMESPath query failed: Invalid syntax at column 7"
+    mock_subprocess_run.side_effect = fake_az(
+        "", returncode=1, stderr="JMESPath query failed: Invalid syntax at column 7"
     )
 
     # Execute query
@@ -200,7 +334,7 @@ def test_jmespath_error_handling(mock_get_configs, mock_subprocess_run, caplog):
         folder_path="/test",
         file_path="query.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify failure
@@ -214,11 +348,7 @@ def test_jmespath_error_handling(mock_get_configs, mock_subprocess_run, caplog):
 @mock.patch("os.makedirs")
 @mock.patch("builtins.open", new_callable=mock.mock_open)
 @mock.patch("gzip.open", new_callable=mock.mock_open)
-@mock.patch("shutil.copyfileobj")
-@mock.patch("os.remove")
 def test_gzip_compression(
-    mock_remove,
-    mock_copyfileobj,
     mock_gzip_open,
     mock_open,
     mock_makedirs,
@@ -234,50 +364,57 @@ def test_gzip_compression(
             compression=CompressionType.GZIP,
         )
     ]
-    mock_subprocess_run.return_value = mock.MagicMock(
-        stdout="test output", stderr="", returncode=0
-    )
+    mock_subprocess_run.side_effect = fake_az("test output")
 
     # Execute query
     result = execute_query(
         folder_path="/test",
         file_path="query.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
     assert result is True
 
-    # Check the sequence of file operations including context manager calls
-    expected_calls = [
-        # Write the initial results
-        mock.call("results/output.json", "w"),
-        mock.call().__enter__(),
-        mock.call().write("test output"),
-        mock.call().__exit__(None, None, None),
-        # Read for compression
-        mock.call("results/output.json", "rb"),
-        mock.call().__enter__(),
-        mock.call().__exit__(None, None, None),
+    # Results are written straight into the gzip file, with no plain copy
+    mock_open.assert_not_called()
+    mock_gzip_open.assert_called_once_with(
+        "results/output.json.gz", "wb", compresslevel=6
+    )
+    mock_gzip_open().write.assert_called_once_with(b"test output")
+
+
+@mock.patch("execute.subprocess.run")
+@mock.patch("execute.get_output_configs_for_query")
+@mock.patch("os.makedirs")
+@mock.patch("gzip.open", new_callable=mock.mock_open)
+def test_gzip_compression_large_chunks(
+    mock_gzip_open, mock_makedirs, mock_get_configs, mock_subprocess_run
+):
+    """Test large results are compressed in 128 KiB chunks."""
+    mock_get_configs.return_value = [
+        OutputConfig(
+            format=OutputFormat.JSON,
+            file="results/output.json",
+            compression=CompressionType.GZIP,
+        )
     ]
-    mock_open.assert_has_calls(expected_calls, any_order=False)
+    mock_subprocess_run.side_effect = fake_az("x" * (300 * 1024))
+
+    assert execute_query("/test", "query.kql", "test-workspace", EMPTY_CONFIG)
 
-    # Verify compression operations
-    mock_gzip_open.assert_called_once_with("results/output.json.gz", "wb")
-    mock_copyfileobj.assert_called_once()
-    mock_remove.assert_called_once_with("results/output.json")
+    chunk_sizes = [len(c.args[0]) for c in mock_gzip_open().write.call_args_list]
+    assert chunk_sizes == [128 * 1024, 128 * 1024, 44 * 1024]
 
 
 @mock.patch("execute.subprocess.run")
 @mock.patch("execute.get_output_configs_for_query")
 @mock.patch("os.makedirs")
 @mock.patch("builtins.open", new_callable=mock.mock_open)
-@mock.patch("shutil.make_archive")
-@mock.patch("os.remove")
+@mock.patch("zipfile.ZipFile")
 def test_zip_compression(
-    mock_remove,
-    mock_make_archive,
+    mock_zipfile,
     mock_open,
     mock_makedirs,
     mock_get_configs,
@@ -292,25 +429,28 @@ def test_zip_compression(
             compression=CompressionType.ZIP,
         )
     ]
-    mock_subprocess_run.return_value = mock.MagicMock(
-        stdout="test output", stderr="", returncode=0
-    )
+    mock_subprocess_run.side_effect = fake_az("test output")
 
     # Execute query
     result = execute_query(
         folder_path="/test",
         file_path="query.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
     assert result is True
-    mock_open.assert_called_once_with("results/output.json", "w")
-    mock_make_archive.assert_called_once()
-    assert "results/output" in mock_make_archive.call_args[0][0]  # base name
-    assert "zip" in mock_make_archive.call_args[0][1]  # format
-    mock_remove.assert_called_once_with("results/output.json")
+
+    # Results are written straight into the archive, with no plain copy
+    mock_open.assert_not_called()
+    mock_zipfile.assert_called_once()
+    assert mock_zipfile.call_args[0][0] == "results/output.zip"
+    assert mock_zipfile.call_args[1]["compresslevel"] == 6
+    archive = mock_zipfile.return_value.__enter__.return_value
+    archive.open.assert_called_once_with("output.json", "w", force_zip64=False)
+    entry = archive.open.return_value.__enter__.return_value
+    entry.write.assert_called_once_with(b"test output")
 
 
 @mock.patch("execute.subprocess.run")
@@ -326,16 +466,14 @@ def test_multiple_formats(mock_get_configs, mock_subprocess_run):
             compression=CompressionType.GZIP,
         ),
     ]
-    mock_subprocess_run.return_value = mock.MagicMock(
-        stdout="test output", stderr="", returncode=0
-    )
+    mock_subprocess_run.side_effect = fake_az("test output")
 
     # Execute query
     result = execute_query(
         folder_path="/test",
         file_path="example.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
@@ -353,6 +491,62 @@ def test_multiple_formats(mock_get_configs, mock_subprocess_run):
     assert "json" in second_call[0][0]
 
 
+@mock.patch("execute.subprocess.run")
+@mock.patch("execute.get_output_configs_for_query")
+@mock.patch("os.makedirs")
+@mock.patch("builtins.open", new_callable=mock.mock_open)
+def test_identical_outputs_share_one_query(
+    mock_open, mock_makedirs, mock_get_configs, mock_subprocess_run
+):
+    """Test that outputs differing only in destination run az once."""
+    # Setup mocks
+    mock_get_configs.return_value = [
+        OutputConfig(format=OutputFormat.JSON, query="length(@)"),
+        OutputConfig(format=OutputFormat.JSON, query="length(@)", file="a/count.json"),
+        OutputConfig(format=OutputFormat.JSON, query="length(@)", file="b/count.json"),
+        OutputConfig(format=OutputFormat.TABLE, query="length(@)"),
+    ]
+    mock_subprocess_run.side_effect = fake_az("5")
+
+    # Execute query
+    result = execute_query(
+        folder_path="/test",
+        file_path="query.kql",
+        workspace_id="test-workspace",
+        config=EMPTY_CONFIG,
+    )
+
+    # Verify one az call per distinct (format, query) pair
+    assert result is True
+    assert mock_subprocess_run.call_count == 2
+    mock_open.assert_any_call("a/count.json", "wb")
+    mock_open.assert_any_call("b/count.json", "wb")
+
+
+@mock.patch("execute.subprocess.run")
+@mock.patch("execute.get_output_configs_for_query")
+def test_overwritten_output_not_reused(mock_get_configs, mock_subprocess_run, tmp_path):
+    """Test an output overwritten by a later one is not reused as a source."""
+    mock_get_configs.return_value = [
+        OutputConfig(format=OutputFormat.JSON, file="a.json"),
+        OutputConfig(format=OutputFormat.TABLE, file="a.json"),
+        OutputConfig(format=OutputFormat.JSON, file="c.json"),
+    ]
+
+    def run(cmd, **kwargs):
+        output_format = cmd[cmd.index("--output") + 1]
+        kwargs["stdout"].write(f"{output_format} output".encode())
+        return subprocess.CompletedProcess(cmd, 0, stderr="")
+
+    mock_subprocess_run.side_effect = run
+
+    assert execute_query("/test", "query.kql", "test-workspace", EMPTY_CONFIG)
+
+    # The last writer of a.json wins; c.json still gets the JSON result
+    assert (tmp_path / "a.json").read_bytes() == b"table output"
+    assert (tmp_path / "c.json").read_bytes() == b"json output"
+
+
 @mock.patch("execute.subprocess.run")
 @mock.patch("execute.get_output_configs_for_query")
 def test_complex_filtering(mock_get_configs, mock_subprocess_run):
@@ -376,16 +570,14 @@ def test_complex_filtering(mock_get_configs, mock_subprocess_run):
             file="alerts/high.json",
         ),  # Filtered by severity=high
     ]
-    mock_subprocess_run.return_value = mock.MagicMock(
-        stdout="test output", stderr="", returncode=0
-    )
+    mock_subprocess_run.side_effect = fake_az("test output")
 
     # Execute query
     result = execute_query(
         folder_path="/test",
         file_path="security-events.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
@@ -413,8 +605,8 @@ def test_error_handling_query_execution(mock_get_configs, mock_subprocess_run, c
     """Test handling of query execution errors."""
     # Setup mocks
     mock_get_configs.return_value = [OutputConfig(format=OutputFormat.JSON)]
-    mock_subprocess_run.side_effect = subprocess.CalledProcessError(
-        1, "az monitor", stderr="Error: Invalid KQL query syntax at line 5"
+    mock_subprocess_run.side_effect = fake_az(
+        "", returncode=1, stderr="Error: Invalid KQL query syntax at line 5"
     )
 
     # Execute query
@@ -422,7 +614,7 @@ def test_error_handling_query_execution(mock_get_configs, mock_subprocess_run, c
         folder_path="/test",
         file_path="query.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
@@ -442,9 +634,7 @@ def test_error_handling_file_operations(
     mock_get_configs.return_value = [
         OutputConfig(format=OutputFormat.JSON, file="results/output.json")
     ]
-    mock_subprocess_run.return_value = mock.MagicMock(
-        stdout="test output", stderr="", returncode=0
-    )
+    mock_subprocess_run.side_effect = fake_az("test output")
     mock_makedirs.side_effect = PermissionError("Permission denied")
 
     # Execute query
@@ -452,7 +642,7 @@ def test_error_handling_file_operations(
         folder_path="/test",
         file_path="query.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
@@ -475,7 +665,7 @@ def test_empty_configurations(mock_get_configs, caplog):
         folder_path="/test",
         file_path="query.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
@@ -491,16 +681,14 @@ def test_network_events_count(mock_get_configs, mock_subprocess_run):
     mock_get_configs.return_value = [
         OutputConfig(format=OutputFormat.JSON, query="length(@)")
     ]
-    mock_subprocess_run.return_value = mock.MagicMock(
-        stdout="42", stderr="", returncode=0
-    )
+    mock_subprocess_run.side_effect = fake_az("42")
 
     # Execute query
     result = execute_query(
         folder_path="/test",
         file_path="network-events.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
@@ -524,16 +712,14 @@ def test_example_basic_configuration(mock_get_configs, mock_subprocess_run):
             compression=CompressionType.GZIP,
         ),  # File output with compression
     ]
-    mock_subprocess_run.return_value = mock.MagicMock(
-        stdout="test output", stderr="", returncode=0
-    )
+    mock_subprocess_run.side_effect = fake_az("test output")
 
     # Execute query
     result = execute_query(
         folder_path="/test",
         file_path="example.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
@@ -551,62 +737,49 @@ def test_example_basic_configuration(mock_get_configs, mock_subprocess_run):
     assert "json" in second_call[0][0]
 
 
-@mock.patch("execute.subprocess.run")
-@mock.patch("execute.get_output_configs_for_query")
-def test_example_multiple_queries(mock_get_configs, mock_subprocess_run):
-    """Test the multiple queries example from documentation."""
-    test_cases = [
+@pytest.mark.parametrize(
+    "file_path, configs, expected_calls",
+    [
         # device.kql with no output
-        (
-            "device.kql",
-            [OutputConfig(format=OutputFormat.NONE)],
-            0,  # Expected call count
-        ),
+        ("device.kql", [OutputConfig(format=OutputFormat.NONE)], 0),
         # user.kql with YAML output
-        (
-            "user.kql",
-            [OutputConfig(format=OutputFormat.YAML)],
-            1,  # Expected call count
-        ),
+        ("user.kql", [OutputConfig(format=OutputFormat.YAML)], 1),
         # network/nsg.kql with TSV output
-        (
-            "network/nsg.kql",
-            [OutputConfig(format=OutputFormat.TSV)],
-            1,  # Expected call count
-        ),
+        ("network/nsg.kql", [OutputConfig(format=OutputFormat.TSV)], 1),
         # network/vm.kql with table output
         (
             "network/vm.kql",
             [OutputConfig(format=OutputFormat.TABLE, file="subdir/vm.txt")],
-            1,  # Expected call count
+            1,
         ),
-    ]
-
-    for file_path, configs, expected_calls in test_cases:
-        # Reset mocks
-        mock_subprocess_run.reset_mock()
-        mock_get_configs.return_value = configs
-        mock_subprocess_run.return_value = mock.MagicMock(
-            stdout="test output", stderr="", returncode=0
-        )
+    ],
+)
+@mock.patch("execute.subprocess.run")
+@mock.patch("execute.get_output_configs_for_query")
+def test_example_multiple_queries(
+    mock_get_configs, mock_subprocess_run, file_path, configs, expected_calls
+):
+    """Test the multiple queries example from documentation."""
+    mock_get_configs.return_value = configs
+    mock_subprocess_run.side_effect = fake_az("test output")
 
-        # Execute query
-        result = execute_query(
-            folder_path="/test",
-            file_path=file_path,
-            workspace_id="test-workspace",
-            config=KQLConfig(),
-        )
+    # Execute query
+    result = execute_query(
+        folder_path="/test",
+        file_path=file_path,
+        workspace_id="test-workspace",
+        config=EMPTY_CONFIG,
+    )
 
-        # Verify
-        assert result is True
-        assert mock_subprocess_run.call_count == expected_calls
+    # Verify
+    assert result is True
+    assert mock_subprocess_run.call_count == expected_calls
 
-        # Check format-specific details
-        if configs[0].format != OutputFormat.NONE:
-            cmd = mock_subprocess_run.call_args[0][0]
-            assert "--output" in cmd
-            assert configs[0].format.value in cmd
+    # Check format-specific details
+    if configs[0].format != OutputFormat.NONE:
+        cmd = mock_subprocess_run.call_args[0][0]
+        assert "--output" in cmd
+        assert configs[0].format.value in cmd
 
 
 @mock.patch("execute.subprocess.run")
@@ -630,16 +803,14 @@ def test_example_security_events_filtering(mock_get_configs, mock_subprocess_run
             for severity in ["critical", "high", "medium", "low"]
         ],
     ]
-    mock_subprocess_run.return_value = mock.MagicMock(
-        stdout="test output", stderr="", returncode=0
-    )
+    mock_subprocess_run.side_effect = fake_az("test output")
 
     # Execute query
     result = execute_query(
         folder_path="/test",
         file_path="security-events.kql",
         workspace_id="test-workspace",
-        config=KQLConfig(),
+        config=EMPTY_CONFIG,
     )
 
     # Verify
@@ -666,3 +837,53 @@ def test_example_security_events_filtering(mock_get_configs, mock_subprocess_run
         assert "json" in cmd
         assert "--query" in cmd
         assert f"events[?severity=='{severity}']" in cmd
+
+
+@mock.patch("execute.subprocess.run")
+@mock.patch("execute.get_output_configs_for_query")
+def test_shared_output_file_written_one_at_a_time(
+    mock_get_configs, mock_subprocess_run, tmp_path
+):
+    """Test a query waits while another query writes the same output file."""
+    mock_get_configs.return_value = [
+        OutputConfig(format=OutputFormat.JSON, file="shared.json")
+    ]
+    mock_subprocess_run.side_effect = fake_az("second output")
+    results = []
+
+    def run_query():
+        results.append(
+            execute_query("/test", "second.kql", "test-workspace", EMPTY_CONFIG)
+        )
+
+    # Simulate another query in the middle of writing the file
+    with execute._output_lock("shared.json"):
+        worker = threading.Thread(target=run_query)
+        worker.start()
+        worker.join(timeout=0.2)
+        assert worker.is_alive()
+        assert not (tmp_path / "shared.json").exists()
+
+    worker.join()
+    assert results == [True]
+    assert (tmp_path / "shared.json").read_bytes() == b"second output"
+
+
+@mock.patch("execute.subprocess.run")
+@mock.patch("execute.get_output_configs_for_query")
+def test_cached_result_skips_az(
+    mock_get_configs, mock_subprocess_run, tmp_path, capsys
+):
+    """Test a fresh cached result is used instead of running az again."""
+    (tmp_path / "query.kql").write_bytes(b"Heartbeat | take 1")
+    mock_get_configs.return_value = [OutputConfig(format=OutputFormat.JSON)]
+    mock_subprocess_run.side_effect = fake_az("cached output")
+    cache = ResultCache(str(tmp_path / "cache"), ttl_seconds=60)
+
+    for _ in range(2):
+        assert execute_query(
+            str(tmp_path), "query.kql", "test-workspace", EMPTY_CONFIG, cache
+        )
+
+    mock_subprocess_run.assert_called_once()
+    assert capsys.readouterr().out.count("cached output") == 2
@@ -1,13 +1,13 @@
-import os
 import re
-import sys
-
-# Add parent directory to path so we can import modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import pytest
+
 from model import CompressionType, KQLConfig, OutputConfig, OutputFormat, QueryConfig
 
+# Expected error messages, compiled once for pytest.raises
+RE_MUST_END_KQL = re.compile(r"Query file must end with \.kql")
+RE_QUERY_WHITESPACE = re.compile(r"Query file path should not contain whitespace")
+
 
 def test_output_format_enum():
     """Test OutputFormat enumeration values."""
@@ -112,7 +112,20 @@ def test_kql_config_defaults():
     """Test KQLConfig default values."""
     config = KQLConfig()
     assert config.version == "1.0"
-    assert config.queries is None
+    assert config.queries == []
+
+    # Each config gets its own list
+    assert KQLConfig().queries is not config.queries
+
+
+def test_config_classes_use_slots():
+    """Test config objects store attributes in slots rather than a __dict__."""
+    for obj in (
+        OutputConfig(format=OutputFormat.JSON),
+        QueryConfig(file="query.kql"),
+        KQLConfig(),
+    ):
+        assert not hasattr(obj, "__dict__")
 
 
 def test_kql_config_with_queries():
@@ -130,18 +143,25 @@ def test_kql_config_with_queries():
 
 def test_kql_config_invalid_query_extension():
     """Test KQLConfig validation for query file extension."""
-    with pytest.raises(ValueError, match="Query file must end with .kql"):
+    with pytest.raises(ValueError, match=RE_MUST_END_KQL):
         KQLConfig(version="1.0", queries=[QueryConfig(file="query.txt")])
 
 
 def test_query_config_whitespace_in_file():
     """Test that QueryConfig rejects file paths with whitespace."""
-    with pytest.raises(
-        ValueError, match="Query file path should not contain whitespace"
-    ):
+    with pytest.raises(ValueError, match=RE_QUERY_WHITESPACE):
         QueryConfig(file="query file.kql")
 
 
+@pytest.mark.parametrize(
+    "file", ["query\tfile.kql", "query\nfile.kql", "query\u00a0file.kql"]
+)
+def test_query_config_other_whitespace_in_file(file):
+    """Test that QueryConfig rejects tabs, newlines and Unicode spaces too."""
+    with pytest.raises(ValueError, match=RE_QUERY_WHITESPACE):
+        QueryConfig(file=file)
+
+
 def test_query_config_valid_file_formats():
     """Test that QueryConfig accepts valid file paths."""
     # Underscore instead of space
@@ -2,10 +2,17 @@ import logging
 
 
 def setup_logging(level: int) -> None:
-    """Configure logging with the specified level."""
+    """Configure the "kql" logger used by the executor with the specified level."""
     log_format = "%(message)s"
     if level == logging.DEBUG:
         log_format = "%(levelname)s: %(message)s"
 
-    handlers = [logging.StreamHandler()]
-    logging.basicConfig(level=level, format=log_format, handlers=handlers)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(log_format))
+
+    # Configure our own logger rather than the root logger, so third-party
+    # libraries keep their defaults and suppressed records are dropped early
+    logger = logging.getLogger("kql")
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False